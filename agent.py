@@ -1,24 +1,43 @@
+from collections import deque
+
+MAX_CONTEXT_TURNS = 5  # Keep the conversation context manageable
+
+
 class ConversationManager:
+    __slots__ = ('context', '_prefix_cache')
+
     def __init__(self):
-        self.context = []
+        self.context = deque(maxlen=MAX_CONTEXT_TURNS)
+        self._prefix_cache: str = ""
 
     def update_context(self, user_input, response):
         """
         Maintains a history of the conversation.
+
+        Each turn is stored already formatted, and the joined history is kept in a
+        cached prefix that is only ever extended, so consecutive prompts share a
+        byte-identical prefix until the oldest turn is evicted.
+        """
+        turn = f"User: {user_input}\nAgent: {response}\n"
+        evicting = len(self.context) == self.context.maxlen
+        self.context.append(turn)
+        if evicting:
+            self._prefix_cache = "".join(self.context)
+        else:
+            self._prefix_cache += turn
+
+    @property
+    def context_prefix(self):
+        """
+        The formatted conversation history that precedes the current input.
         """
-        self.context.append({"user": user_input, "agent": response})
-        if len(self.context) > 5:  # Keep the conversation context manageable
-            self.context.pop(0)
+        return self._prefix_cache
 
     def build_prompt(self, user_input):
         """
         Builds a dynamic prompt using the context and the current input.
         """
-        prompt = ""
-        for exchange in self.context:
-            prompt += f"User: {exchange['user']}\nAgent: {exchange['agent']}\n"
-        prompt += f"User: {user_input}\nAgent:"
-        return prompt
+        return self._prefix_cache + f"User: {user_input}\nAgent:"
 
     async def process_input(self, user_input, get_response_fn):
         """
@@ -27,4 +46,4 @@ class ConversationManager:
         prompt = self.build_prompt(user_input)
         response = await get_response_fn(prompt)
         self.update_context(user_input, response)
-        return response
\ No newline at end of file
+        return response
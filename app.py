@@ -1,15 +1,31 @@
 # app.py - Enterprise MLOps Version
 import asyncio
-import uuid
+import hashlib
+import os
+import secrets
+import shutil
+import time
+from datetime import datetime
+from typing import Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from cachetools import TTLCache
 from agent import ConversationManager
-from vertex_ai import get_mental_health_response
-from enterprise_monitoring import enterprise_monitor, generate_latest, CONTENT_TYPE_LATEST
+from semantic_cache import semantic_cache
+from vertex_ai import (
+    DedupVertexClient, get_mental_health_response,
+    open_http_client, close_http_client, http_pool_stats
+)
+from enterprise_monitoring import (
+    enterprise_monitor, async_generate_latest,
+    CONTENT_TYPE_LATEST, METRICS_REGISTRY
+)
 import logging
+import uvicorn
 
 # Configure structured logging
 logger = logging.getLogger("mental_health_companion")
@@ -18,29 +34,63 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
+# Monotonic clock for latency math; wall-clock time can jump on NTP adjustment
+_time_monotonic = time.monotonic
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     # Startup
     logger.info("Starting Mental Health Companion with Enterprise MLOps")
+    app.state.started_at = _time_monotonic()
     await enterprise_monitor.start_background_tasks()
+    await asyncio.to_thread(semantic_cache.load)
+    open_http_client()
+    vertex_client.open()
     
     yield
     
     # Shutdown
     logger.info("Shutting down Mental Health Companion")
+    await vertex_client.close()
+    await close_http_client()
 
 app = FastAPI(
     title="Mental Health Companion API",
     description="Enterprise-grade AI companion for mental health support with comprehensive MLOps",
     version="1.2.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Instrument FastAPI with OpenTelemetry
 app = enterprise_monitor.instrument_fastapi(app)
 
-conversation_manager = ConversationManager()
+class SessionCache(TTLCache):
+    """TTLCache of conversation managers that reports evicted sessions as ended"""
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for session_id, _ in expired:
+            enterprise_monitor.update_session_count(session_id, 'end')
+        return expired
+
+    def popitem(self):
+        session_id, manager = super().popitem()
+        enterprise_monitor.update_session_count(session_id, 'end')
+        return session_id, manager
+
+# One conversation history per session; idle sessions are evicted
+_managers: SessionCache = SessionCache(maxsize=10_000, ttl=1800)
+
+# Exact-match response cache keyed by a digest of the fully built prompt
+_response_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+_response_cache_lock = asyncio.Lock()
+
+# Serialized /metrics payload, reused for scrapes landing within the TTL
+METRICS_CACHE_TTL_SECONDS = 1.0
+_metrics_cache = (0.0, b"")
+_metrics_cache_lock = asyncio.Lock()
 
 # CORS middleware
 app.add_middleware(
@@ -51,12 +101,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MAX_INPUT_LENGTH = 10_000
+
 class UserInput(BaseModel):
+    # Reject unknown keys and oversized prompts before they reach the conversation manager
+    model_config = ConfigDict(
+        extra='forbid',
+        frozen=True,
+        str_strip_whitespace=True,
+        str_max_length=MAX_INPUT_LENGTH
+    )
+
     prompt: str
-    session_id: str = None
-    user_agent: str = None
+    session_id: Optional[str] = None
+    user_agent: Optional[str] = None
 
 class MentalHealthResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
     response: str
     session_id: str
     model_version: str
@@ -67,35 +129,43 @@ class MentalHealthResponse(BaseModel):
 @enterprise_monitor.track_request
 async def mental_health(input: UserInput, request: Request):
     """Enhanced mental health endpoint with comprehensive monitoring"""
-    import time
-    start_time = time.time()
+    start_time = _time_monotonic()
     
     # Generate session ID if not provided
-    session_id = input.session_id or str(uuid.uuid4())
+    session_id = input.session_id or secrets.token_hex(16)
     user_agent = input.user_agent or request.headers.get('user-agent', 'unknown')
     
     user_input = input.prompt
     if not user_input:
-        logger.warning("Empty input received", session_id=session_id)
+        logger.warning("Empty input received in session %s", session_id)
         raise HTTPException(status_code=400, detail="No input provided")
 
-    # Update session tracking
-    enterprise_monitor.update_session_count(session_id, 'start')
+    # Session tracking counts each conversation once, when its manager is created
+    manager = _managers.get(session_id)
+    new_session = manager is None
+    if new_session:
+        manager = ConversationManager()
+        enterprise_monitor.update_session_count(session_id, 'start')
+    _managers[session_id] = manager  # Re-insert to refresh the session TTL
     
     try:
         # AI request with monitoring
-        response = await get_monitored_ai_response(user_input)
+        response = await get_monitored_ai_response(user_input, manager, session_id)
         
         # Calculate metrics
-        response_time_ms = (time.time() - start_time) * 1000
+        response_time_ms = (_time_monotonic() - start_time) * 1000
         quality_score = enterprise_monitor._calculate_quality_score(response)
+        enterprise_monitor.record_quality_score(quality_score)
         
         # Track conversation
         # Simulate message count (in real app, get from conversation manager)
         message_count = 1
-        enterprise_monitor.track_conversation(session_id, message_count, quality_score)
+        enterprise_monitor.defer(enterprise_monitor.track_conversation, session_id, message_count, quality_score)
         
-        logger.info(f"Request completed successfully in session {session_id} with response time {response_time_ms:.2f} ms and quality score {quality_score:.2f}")
+        logger.info(
+            "Request completed successfully in session %s with response time %.2f ms and quality score %.2f",
+            session_id, response_time_ms, quality_score
+        )
         
         return MentalHealthResponse(
             response=response,
@@ -106,17 +176,60 @@ async def mental_health(input: UserInput, request: Request):
         )
         
     except Exception as e:
-        logger.error(f"Error processing mental health request in session {session_id}. The error is {str(e)}")
-        enterprise_monitor.update_session_count(session_id, 'end')
+        logger.error("Error processing mental health request in session %s. The error is %s", session_id, e)
+        if new_session and _managers.pop(session_id, None) is not None:
+            enterprise_monitor.update_session_count(session_id, 'end')
         raise HTTPException(
             status_code=500,
             detail="An error occurred while processing your request. Please try again."
         )
 
 @enterprise_monitor.track_ai_request("gemini-2.5-flash-preview-05-20")
-async def get_monitored_ai_response(user_input: str) -> str:
-    """AI response with monitoring wrapper"""
-    return await conversation_manager.process_input(user_input, get_mental_health_response)
+async def call_vertex(prompt: str) -> str:
+    """Vertex AI call with monitoring wrapper; cache hits never reach it"""
+    return await get_mental_health_response(prompt)
+
+# Identical prompts in flight at the same time share one monitored Vertex AI call
+vertex_client = DedupVertexClient(call_vertex)
+
+async def get_monitored_ai_response(user_input: str, manager: ConversationManager, session_id: str) -> str:
+    """AI response for the next turn of a conversation, served from cache when possible"""
+    # Semantic matches never cross sessions: a paraphrase is only close enough to
+    # reuse a reply given to the same user earlier in the same conversation
+    context_key = _digest(session_id + "\0" + manager.context_prefix)
+
+    async def get_response(prompt: str) -> str:
+        return await get_cached_response(prompt, user_input, context_key)
+
+    return await manager.process_input(user_input, get_response)
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+async def get_cached_response(prompt: str, user_input: str, context_key: bytes) -> str:
+    """Serve repeated prompts from the exact-match cache, then paraphrases from the
+    semantic cache, calling Vertex AI only when both miss"""
+    key = _digest(prompt)
+    async with _response_cache_lock:
+        cached = _response_cache.get(key)
+    if cached is not None:
+        enterprise_monitor.record_cache_hit('exact')
+        return cached
+
+    embedding = None
+    if semantic_cache.enabled:
+        embedding = await semantic_cache.embed(user_input)
+        cached = semantic_cache.lookup(embedding, context_key)
+        if cached is not None:
+            enterprise_monitor.record_cache_hit('semantic')
+            return cached
+
+    response = await vertex_client.submit(prompt)
+    async with _response_cache_lock:
+        _response_cache[key] = response
+    if embedding is not None:
+        semantic_cache.add(embedding, context_key, response)
+    return response
 
 @app.post("/api/end-conversation")
 async def end_conversation(request: dict):
@@ -125,11 +238,12 @@ async def end_conversation(request: dict):
     satisfaction_score = request.get("satisfaction_score")
     
     if session_id:
-        enterprise_monitor.update_session_count(session_id, 'end')
+        if _managers.pop(session_id, None) is not None:
+            enterprise_monitor.update_session_count(session_id, 'end')
         if satisfaction_score:
             enterprise_monitor.track_conversation(session_id, 1, satisfaction_score)
         
-        logger.info("Conversation ended", session_id=session_id, satisfaction=satisfaction_score)
+        logger.info("Conversation ended in session %s with satisfaction %s", session_id, satisfaction_score)
         return {"message": "Conversation ended successfully"}
     else:
         raise HTTPException(status_code=400, detail="Session ID required")
@@ -139,16 +253,13 @@ async def end_conversation(request: dict):
 @enterprise_monitor.track_request
 async def comprehensive_health():
     """Comprehensive health check with detailed system status"""
-    import psutil
-    from datetime import datetime
-    
-    # System health
-    memory = psutil.virtual_memory()
-    cpu_percent = psutil.cpu_percent(interval=1)
-    disk = psutil.disk_usage('/')
+    # System health, memoized by the background metrics task
+    system = enterprise_monitor.last_system_snapshot
+    memory_percent = system.get('memory_percent', 0.0)
+    cpu_percent = system.get('cpu_percent', 0.0)
     
     # Application health
-    active_sessions = len(enterprise_monitor.active_sessions)
+    active_sessions = enterprise_monitor.active_sessions
     
     health_status = {
         "status": "healthy",
@@ -156,13 +267,13 @@ async def comprehensive_health():
         "service": {
             "name": "mental-health-app",
             "version": "1.2.0",
-            "uptime_seconds": time.time() - start_time if 'start_time' in globals() else 0
+            "uptime_seconds": _time_monotonic() - app.state.started_at
         },
         "system": {
-            "memory_usage_percent": memory.percent,
-            "memory_available_gb": round(memory.available / (1024**3), 2),
+            "memory_usage_percent": memory_percent,
+            "memory_available_gb": round(system.get('memory_available_gb', 0.0), 2),
             "cpu_usage_percent": cpu_percent,
-            "disk_usage_percent": round((disk.used / disk.total) * 100, 2)
+            "disk_usage_percent": round(system.get('disk_percent', 0.0), 2)
         },
         "application": {
             "active_sessions": active_sessions,
@@ -176,35 +287,49 @@ async def comprehensive_health():
     }
     
     # Determine overall status
-    if memory.percent > 90 or cpu_percent > 90:
+    if memory_percent > 90 or cpu_percent > 90:
         health_status["status"] = "warning"
     
     return health_status
 
 @app.get("/metrics")
 async def prometheus_metrics():
-    """Prometheus metrics endpoint"""
-    # Update system metrics before returning
-    enterprise_monitor.update_system_metrics()
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    """Prometheus metrics endpoint; system metrics are refreshed by the background task"""
+    global _metrics_cache
+    async with _metrics_cache_lock:
+        generated_at, data = _metrics_cache
+        now = _time_monotonic()
+        if not data or now - generated_at > METRICS_CACHE_TTL_SECONDS:
+            data = await async_generate_latest(METRICS_REGISTRY)
+            _metrics_cache = (now, data)
+    return Response(data, media_type=CONTENT_TYPE_LATEST, headers={"Content-Length": str(len(data))})
 
 @app.get("/metrics/custom")
 async def custom_metrics():
     """Custom application metrics in JSON format"""
     return {
-        "active_sessions": len(enterprise_monitor.active_sessions),
+        "active_sessions": enterprise_monitor.active_sessions,
         "total_requests": "see_prometheus",
         "average_response_time": "see_prometheus",
         "error_rate": "see_prometheus",
         "user_satisfaction": "see_prometheus"
     }
 
+@app.get("/admin/pool_stats")
+async def pool_stats():
+    """Connection pool usage of the shared Vertex AI HTTP client"""
+    if not os.getenv("ENABLE_DEBUG_ENDPOINTS"):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {"vertex_ai": http_pool_stats()}
+
 @app.get("/debug/trace")
 async def debug_trace():
     """Debug endpoint to test distributed tracing"""
+    if not os.getenv("ENABLE_DEBUG_ENDPOINTS"):
+        raise HTTPException(status_code=404, detail="Not Found")
     with enterprise_monitor.tracer.start_as_current_span("debug_trace") as span:
         span.set_attribute("debug.test", True)
-        await asyncio.sleep(0.1)  # Simulate work
+        span.set_attribute("sampling.priority", 1)  # Always export past the tail filter
         logger.info("Debug trace executed")
         return {"message": "Trace generated", "trace_id": hex(span.get_span_context().trace_id)}
     
@@ -213,14 +338,12 @@ async def test_trace():
     with enterprise_monitor.tracer.start_as_current_span("TEST_TRACE") as span:
         span.set_attribute("service.name", "mental-health-app")
         span.set_attribute("test", "explicit")
+        span.set_attribute("sampling.priority", 1)
         return {"message": "Test trace sent to Jaeger"}
 
 @app.get("/stats/dashboard")
 async def dashboard_stats():
     """Stats endpoint for custom dashboards"""
-    import time
-    from datetime import datetime, timedelta
-    
     return {
         "timestamp": datetime.now().isoformat(),
         "service_info": {
@@ -229,7 +352,7 @@ async def dashboard_stats():
             "environment": "docker"
         },
         "current_metrics": {
-            "active_sessions": len(enterprise_monitor.active_sessions),
+            "active_sessions": enterprise_monitor.active_sessions,
             "requests_per_minute": "calculated_by_prometheus",
             "average_response_time": "calculated_by_prometheus",
             "error_rate_percent": "calculated_by_prometheus"
@@ -246,17 +369,24 @@ async def dashboard_stats():
 app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
 
 if __name__ == '__main__':
-    import uvicorn
-    import time
-    
-    start_time = time.time()
-    
     logger.info("Starting Mental Health Companion with Enterprise MLOps Version 1.2.0")
 
-    
+    # Conversation history is kept per worker process, and uvicorn workers share one socket,
+    # so with more than one worker follow-up turns can land on a worker without the context
+    workers = int(os.getenv("UVICORN_WORKERS", 1))
+    if workers > 1:
+        # Workers write metrics to mmap files that /metrics merges; start from an empty
+        # directory before any worker process creates a metric
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prom_multiproc")
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
     uvicorn.run(
-        app, 
+        # Worker processes import the app themselves; a single worker serves this one
+        app if workers == 1 else "app:app",
         host="0.0.0.0", 
         port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
         log_config=None  # Use standard logger configuration
     )
@@ -3,13 +3,22 @@ import time
 import asyncio
 import json
 import os
+import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Optional, Any
 from functools import wraps
+import functools
+from types import SimpleNamespace
 import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from prometheus_client import (
     Counter, Histogram, Gauge, Summary, Info,
-    generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry
+    generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, multiprocess
 )
 
 # OpenTelemetry imports
@@ -22,7 +31,6 @@ from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExport
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
 
 # Try multiple exporter options
 try:
@@ -31,18 +39,18 @@ try:
 except ImportError:
     OTLP_AVAILABLE = False
 
-try:
-    from opentelemetry.exporter.jaeger.thrift import JaegerExporter
-    JAEGER_AVAILABLE = True
-except ImportError:
-    JAEGER_AVAILABLE = False
-
 try:
     from opentelemetry.exporter.prometheus import PrometheusMetricReader
     PROMETHEUS_READER_AVAILABLE = True
 except ImportError:
     PROMETHEUS_READER_AVAILABLE = False
 
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
@@ -51,90 +59,299 @@ logging.basicConfig(
 
 logger = logging.getLogger("enterprise_monitoring")
 
-# Prometheus Metrics
-REQUEST_COUNT = Counter(
-    'mental_health_requests_total',
-    'Total number of HTTP requests',
-    ['method', 'endpoint', 'status_code', 'user_agent']
-)
+# Scrape and probe endpoints that don't need request spans
+TRACING_EXCLUDED_URLS = os.getenv('OTEL_PYTHON_FASTAPI_EXCLUDED_URLS', '/metrics,/health')
 
-REQUEST_DURATION = Histogram(
-    'mental_health_request_duration_seconds',
-    'HTTP request duration in seconds',
-    ['method', 'endpoint'],
-    buckets=[0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
-)
+# OpenTelemetry providers are process-global, so a second EnterpriseMonitoring in the same
+# process reuses them; this records whether the first setup enabled tracing
+_SETUP_TRACING_ENABLED: Optional[bool] = None
 
-AI_MODEL_REQUESTS = Counter(
-    'mental_health_ai_requests_total',
-    'Total AI model requests',
-    ['model_name', 'status']
-)
+# Prometheus multiprocess mode is used only when PROMETHEUS_MULTIPROC_DIR is set before workers
+# start (app.py's multi-worker __main__ and gunicorn.conf.py do this): each worker then writes
+# samples to mmap files in that directory and /metrics merges them. Otherwise the default
+# registry is served as is.
+MULTIPROCESS_METRICS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
 
-AI_MODEL_LATENCY = Histogram(
-    'mental_health_ai_latency_seconds',
-    'AI model response latency',
-    ['model_name'],
-    buckets=[0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
-)
+# Registry served by /metrics
+if MULTIPROCESS_METRICS:
+    METRICS_REGISTRY = CollectorRegistry()
+    multiprocess.MultiProcessCollector(METRICS_REGISTRY)
+else:
+    METRICS_REGISTRY = REGISTRY
 
-CONVERSATION_METRICS = Counter(
-    'mental_health_conversations_total',
-    'Total conversations',
-    ['conversation_type', 'completion_status']
-)
+async def async_generate_latest(registry: CollectorRegistry = METRICS_REGISTRY) -> bytes:
+    """generate_latest() on the default thread pool, so collecting and serializing
+    the samples doesn't block the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, generate_latest, registry)
 
-ACTIVE_SESSIONS = Gauge(
-    'mental_health_active_sessions',
-    'Number of active user sessions'
-)
+# Prometheus metrics are registered on first use, so importing this module for its
+# helpers doesn't pay for metric registration
+@functools.cache
+def _metrics() -> SimpleNamespace:
+    m = SimpleNamespace(
+        request_count=Counter(
+            'mental_health_requests_total',
+            'Total number of HTTP requests',
+            ['method', 'endpoint', 'status_code', 'user_agent_class']
+        ),
+        request_duration=Histogram(
+            'mental_health_request_duration_seconds',
+            'HTTP request duration in seconds',
+            ['method', 'endpoint'],
+            buckets=[0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+        ),
+        ai_model_requests=Counter(
+            'mental_health_ai_requests_total',
+            'Total AI model requests',
+            ['model_name', 'status']
+        ),
+        ai_model_latency=Histogram(
+            'mental_health_ai_latency_seconds',
+            'AI model response latency',
+            ['model_name'],
+            buckets=[0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
+        ),
+        conversation_metrics=Counter(
+            'mental_health_conversations_total',
+            'Total conversations',
+            ['conversation_type', 'completion_status']
+        ),
+        active_sessions=Gauge(
+            'mental_health_active_sessions',
+            'Number of active user sessions',
+            multiprocess_mode='livesum'
+        ),
+        sessions_started=Counter(
+            'mental_health_sessions_started_total',
+            'Total user sessions started'
+        ),
+        sessions_ended=Counter(
+            'mental_health_sessions_ended_total',
+            'Total user sessions ended or expired'
+        ),
+        response_quality_score=Histogram(
+            'mental_health_response_quality',
+            'Response quality scores',
+            ['quality_dimension'],
+            buckets=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+        ),
+        user_satisfaction=Summary(
+            'mental_health_user_satisfaction',
+            'User satisfaction scores'
+        ),
+        error_rate=Counter(
+            'mental_health_errors_total',
+            'Total application errors',
+            ['error_type', 'severity', 'component']
+        ),
+        system_resources=Gauge(
+            'mental_health_system_resources',
+            'System resource usage',
+            ['resource_type'],
+            multiprocess_mode='liveall'
+        ),
+        cache_hits=Counter(
+            'mental_health_response_cache_hits_total',
+            'AI responses served from cache instead of the model',
+            ['cache_tier']
+        ),
+        span_drops=Counter(
+            'otel_span_drops_total',
+            'Spans dropped because the batch span processor queue was full'
+        ),
+        bsp_queue_depth=Gauge(
+            'otel_bsp_queue_depth',
+            'Spans waiting in the batch span processor queue',
+            multiprocess_mode='livesum'
+        ),
+        otel_http_pool_inuse=Gauge(
+            'otel_http_pool_inuse',
+            'Connections checked out of the OTLP HTTP exporter pool',
+            multiprocess_mode='livesum'
+        ),
+        otel_http_pool_max=Gauge(
+            'otel_http_pool_max',
+            'Connection capacity of the OTLP HTTP exporter pool',
+            multiprocess_mode='livesum'
+        ),
+        app_info=Info(
+            'mental_health_app_info',
+            'Application information'
+        )
+    )
 
-RESPONSE_QUALITY_SCORE = Histogram(
-    'mental_health_response_quality',
-    'Response quality scores',
-    ['quality_dimension'],
-    buckets=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
-)
+    # Pre-bound label children for the hot request path
+    m.req_ok = {
+        ua_class: m.request_count.labels('POST', '/api/mental-health', '200', ua_class)
+        for ua_class in UA_CLASSES
+    }
+    m.req_err = {
+        ua_class: m.request_count.labels('POST', '/api/mental-health', '500', ua_class)
+        for ua_class in UA_CLASSES
+    }
+    m.req_duration = m.request_duration.labels('POST', '/api/mental-health')
+    m.quality_overall = m.response_quality_score.labels(quality_dimension='overall')
+    m.resource_gauges = {
+        resource_type: m.system_resources.labels(resource_type=resource_type)
+        for resource_type in ('memory_percent', 'memory_available_gb', 'cpu_percent', 'disk_percent')
+    }
 
-USER_SATISFACTION = Summary(
-    'mental_health_user_satisfaction',
-    'User satisfaction scores'
-)
+    # Set application info
+    m.app_info.info({
+        'version': '1.2.0',
+        'service': "mental-health-app",
+        'environment': os.getenv('ENVIRONMENT', 'production'),
+        'build_date': datetime.now().isoformat()
+    })
+    return m
 
-ERROR_RATE = Counter(
-    'mental_health_errors_total',
-    'Total application errors',
-    ['error_type', 'severity', 'component']
-)
+# Batch span processor tuning; the SDK defaults drop spans under burst load
+BSP_MAX_QUEUE_SIZE = int(os.getenv('OTEL_BSP_MAX_QUEUE_SIZE', 4096))
+BSP_SCHEDULE_DELAY_MILLIS = int(os.getenv('OTEL_BSP_SCHEDULE_DELAY', 1000))
+BSP_MAX_EXPORT_BATCH_SIZE = int(os.getenv('OTEL_BSP_MAX_EXPORT_BATCH_SIZE', 256))
+BSP_EXPORT_TIMEOUT_MILLIS = int(os.getenv('OTEL_BSP_EXPORT_TIMEOUT', 10000))
 
-SYSTEM_RESOURCES = Gauge(
-    'mental_health_system_resources',
-    'System resource usage',
-    ['resource_type']
-)
+class MonitoredBatchSpanProcessor(BatchSpanProcessor):
+    """BatchSpanProcessor with tuned defaults that reports queue overflow"""
+    
+    def __init__(self, span_exporter):
+        super().__init__(
+            span_exporter,
+            max_queue_size=BSP_MAX_QUEUE_SIZE,
+            schedule_delay_millis=BSP_SCHEDULE_DELAY_MILLIS,
+            max_export_batch_size=BSP_MAX_EXPORT_BATCH_SIZE,
+            export_timeout_millis=BSP_EXPORT_TIMEOUT_MILLIS
+        )
+    
+    def on_end(self, span):
+        # A full queue evicts its oldest span to make room for this one
+        max_queue_size = getattr(self, 'max_queue_size', None)
+        if max_queue_size is not None and self.queue_depth() >= max_queue_size:
+            _metrics().span_drops.inc()
+        super().on_end(span)
+    
+    def queue_depth(self) -> int:
+        return len(getattr(self, 'queue', ()))
 
-APP_INFO = Info(
-    'mental_health_app_info',
-    'Application information'
-)
+# Set MONITORING_DISABLED=1 to leave decorated functions unwrapped
+MONITORING_DISABLED = os.getenv('MONITORING_DISABLED') == '1'
+
+# Tail sampling: only traces that were slow, failed or scored poorly are exported
+TAIL_SAMPLING_ENABLED = os.getenv('OTEL_TAIL_SAMPLING', 'true').lower() != 'false'
+SLOW_REQUEST_SECONDS = 2.0
+LOW_QUALITY_SCORE = 0.4
+
+class TailFilterSpanProcessor(MonitoredBatchSpanProcessor):
+    """Buffers each trace's spans until its local root ends, then exports them only if
+    some span was marked sampling.priority=1 or ended with an error"""
+    
+    def __init__(self, span_exporter, max_traces: int = BSP_MAX_QUEUE_SIZE):
+        super().__init__(span_exporter)
+        self._max_traces = max_traces
+        self._pending = OrderedDict()  # trace_id -> (spans, interesting)
+        self._decided = OrderedDict()  # trace_id -> interesting, for spans ending after their root
+        self._tail_lock = threading.Lock()
+    
+    @staticmethod
+    def _is_interesting(span) -> bool:
+        return (span.attributes.get("sampling.priority") == 1
+                or span.status.status_code is trace.StatusCode.ERROR)
+    
+    def on_end(self, span):
+        trace_id = span.context.trace_id
+        interesting = self._is_interesting(span)
+        with self._tail_lock:
+            if trace_id in self._decided:
+                export = [span] if self._decided[trace_id] or interesting else []
+            else:
+                spans, trace_interesting = self._pending.pop(trace_id, ([], False))
+                spans.append(span)
+                trace_interesting = trace_interesting or interesting
+                if span.parent is not None and not span.parent.is_remote:
+                    self._pending[trace_id] = (spans, trace_interesting)
+                    if len(self._pending) > self._max_traces:
+                        self._pending.popitem(last=False)
+                    return
+                self._decided[trace_id] = trace_interesting
+                if len(self._decided) > self._max_traces:
+                    self._decided.popitem(last=False)
+                export = spans if trace_interesting else []
+        for finished in export:
+            super().on_end(finished)
+
+# Shared keep-alive pool for the OTLP HTTP exporter
+OTLP_HTTP_POOL_CONNECTIONS = 32
+OTLP_HTTP_POOL_MAXSIZE = 64
+
+def _otlp_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=OTLP_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=OTLP_HTTP_POOL_MAXSIZE,
+        # Connection failures only; the exporter already backs off and retries on 5xx
+        max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _http_pool_usage(session: requests.Session):
+    """(in use, capacity) summed over the session's per-host connection pools"""
+    in_use = capacity = 0
+    # The same adapter is mounted for http:// and https://; count each one once
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            queue = getattr(pool, 'pool', None)
+            if queue is None:
+                continue
+            in_use += queue.maxsize - queue.qsize()
+            capacity += queue.maxsize
+    return in_use, capacity
+
+def _span_processor_for(span_exporter) -> MonitoredBatchSpanProcessor:
+    if TAIL_SAMPLING_ENABLED:
+        return TailFilterSpanProcessor(span_exporter)
+    return MonitoredBatchSpanProcessor(span_exporter)
+
+# Empathy keywords counted by the response quality score
+_EMPATHY_RE = re.compile(r'\b(?:understand|feel|support|help|care)\b', re.IGNORECASE)
+
+# User agents are bucketed into a closed set so the label can't grow without bound
+_UA_TABLE = [
+    (re.compile(r'bot|crawl|spider', re.I), 'bot'),
+    (re.compile(r'curl|wget|python-requests|httpx', re.I), 'tool'),
+    (re.compile(r'Mobile|Android|iPhone', re.I), 'mobile'),
+    (re.compile(r'Mozilla', re.I), 'browser'),
+]
+UA_CLASSES = ('bot', 'tool', 'mobile', 'browser', 'other')
+
+def classify_ua(user_agent: str) -> str:
+    """Map a User-Agent header to one of UA_CLASSES"""
+    for pattern, ua_class in _UA_TABLE:
+        if pattern.search(user_agent):
+            return ua_class
+    return 'other'
 
 class EnterpriseMonitoring:
     """Enterprise-grade monitoring with robust OpenTelemetry setup"""
     
     def __init__(self, service_name: str = "mental-health-app"):
         self.service_name = "mental-health-app"
-        self.active_sessions = set()
+        self._active_session_count = 0
         self.tracing_enabled = True
+        self._last_system_snapshot: Dict[str, float] = {}
+        self._error_counters: Dict[tuple, Any] = {}
+        if PSUTIL_AVAILABLE:
+            # Prime the CPU counters so later interval=None calls measure since startup
+            psutil.cpu_percent(interval=None)
+        self.span_processor = None
+        self._otlp_http_session = None
         self.setup_telemetry()
         
-        # Set application info
-        APP_INFO.info({
-            'version': '1.2.0',
-            'service': "mental-health-app",
-            'environment': os.getenv('ENVIRONMENT', 'production'),
-            'build_date': datetime.now().isoformat()
-        })
-        
     # def setup_telemetry(self):
     #     """Setup OpenTelemetry with Console exporter for debugging"""
     #     try:
@@ -165,6 +382,19 @@ class EnterpriseMonitoring:
     #         self.tracing_enabled = False
 
     def setup_telemetry(self):
+        """Setup OpenTelemetry once per process, reusing the registered providers afterwards"""
+        global _SETUP_TRACING_ENABLED
+        if _SETUP_TRACING_ENABLED is not None:
+            logger.info("OpenTelemetry already configured in this process, reusing providers")
+            self.tracer = trace.get_tracer(__name__)
+            self.meter = metrics.get_meter(__name__)
+            self.tracing_enabled = _SETUP_TRACING_ENABLED
+            self.setup_metrics()
+            return
+        self._configure_telemetry()
+        _SETUP_TRACING_ENABLED = self.tracing_enabled
+    
+    def _configure_telemetry(self):
         """Setup OpenTelemetry with OTLP (modern approach)"""
         try:
             # Check if tracing should be disabled
@@ -186,13 +416,14 @@ class EnterpriseMonitoring:
             # Setup tracing
             trace.set_tracer_provider(TracerProvider(resource=resource))
             self.tracer = trace.get_tracer(__name__)
-            metrics.set_meter_provider(MeterProvider(resource=resource))
+            readers = [PrometheusMetricReader()] if PROMETHEUS_READER_AVAILABLE else []
+            metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=readers))
             self.meter = metrics.get_meter(__name__)
 
             span_processor = None
             environment = os.getenv('ENVIRONMENT', 'production')
             
-            logger.info(f"🔧 Setting up OTLP tracing for environment: {environment}")
+            logger.info("🔧 Setting up OTLP tracing for environment: %s", environment)
             
             # Option 1: OTLP gRPC (Primary - matches your docker-compose config)
             try:
@@ -203,7 +434,7 @@ class EnterpriseMonitoring:
                 else:  # docker
                     otlp_endpoint = 'http://jaeger:4317'
                 
-                logger.info(f"🎯 Attempting OTLP gRPC: {otlp_endpoint}")
+                logger.info("🎯 Attempting OTLP gRPC: %s", otlp_endpoint)
                 
                 # Make sure we're using the gRPC version
                 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter as GRPCOTLPSpanExporter
@@ -213,58 +444,63 @@ class EnterpriseMonitoring:
                     insecure=True  # This should work with the gRPC version
                 )
                 
-                span_processor = BatchSpanProcessor(otlp_exporter)
+                span_processor = _span_processor_for(otlp_exporter)
                 logger.info("✅ OTLP gRPC exporter configured successfully")
                 self.tracing_enabled = True
                 
             except Exception as e:
-                logger.warning(f"❌ OTLP gRPC exporter failed: {e}")
+                logger.warning("❌ OTLP gRPC exporter failed: %s", e)
             
-            # Option 2: OTLP HTTP as fallback
+            # Option 2: OTLP HTTP as fallback (ACKed, retried delivery to the collector's HTTP port)
             if not span_processor:
                 try:
                     if environment == 'local':
-                        otlp_endpoint = 'http://localhost:4317'
+                        otlp_endpoint = 'http://localhost:4318/v1/traces'
                     elif environment == 'kubernetes':
-                        otlp_endpoint = 'http://jaeger.mental-health-monitoring:4317'
+                        otlp_endpoint = 'http://jaeger.mental-health-monitoring:4318/v1/traces'
                     else:  # docker
-                        otlp_endpoint = 'http://jaeger:4317'
+                        otlp_endpoint = 'http://jaeger:4318/v1/traces'
                     
-                    logger.info(f"🎯 Attempting OTLP gRPC: {otlp_endpoint}")
+                    logger.info("🎯 Attempting OTLP HTTP: %s", otlp_endpoint)
                     
+                    self._otlp_http_session = _otlp_http_session()
                     otlp_exporter = OTLPSpanExporter(
                         endpoint=otlp_endpoint,
                         # Use headers for insecure connection instead of insecure parameter
-                        headers={}
+                        headers={},
+                        session=self._otlp_http_session
                     )
                     
-                    span_processor = BatchSpanProcessor(otlp_exporter)
-                    logger.info("✅ OTLP gRPC exporter configured successfully")
+                    span_processor = _span_processor_for(otlp_exporter)
+                    logger.info("✅ OTLP HTTP exporter configured successfully")
                     self.tracing_enabled = True
                     
                 except Exception as e:
-                    logger.warning(f"❌ OTLP gRPC exporter failed: {e}")
+                    logger.warning("❌ OTLP HTTP exporter failed: %s", e)
             
-            # Option 3: Console exporter as final fallback
+            # Option 3: No reachable backend - skip span creation entirely unless a developer
+            # opts in to console output with OTEL_CONSOLE_DEBUG=1
             if not span_processor:
-                logger.info("🔧 Using console exporter - traces will appear in logs")
-                console_exporter = ConsoleSpanExporter()
-                span_processor = SimpleSpanProcessor(console_exporter)
-                self.tracing_enabled = True
+                if os.getenv('OTEL_CONSOLE_DEBUG') == '1':
+                    logger.info("🔧 Using console exporter - traces will appear in logs")
+                    trace.get_tracer_provider().add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+                    self.tracing_enabled = True
+                else:
+                    logger.warning("No trace exporter available, tracing disabled")
+                    self.tracing_enabled = False
             
             # Add span processor
             if span_processor:
                 trace.get_tracer_provider().add_span_processor(span_processor)
+                self.span_processor = span_processor
             
             self.setup_metrics()
-            logger.info(f"🎉 OpenTelemetry setup complete for {self.service_name} (tracing: {self.tracing_enabled})")
+            logger.info("🎉 OpenTelemetry setup complete for %s (tracing: %s)", self.service_name, self.tracing_enabled)
             
         except Exception as e:
-            logger.error(f"💥 OpenTelemetry setup failed: {e}")
-            # Minimal fallback setup
-            trace.set_tracer_provider(TracerProvider())
+            logger.error("💥 OpenTelemetry setup failed: %s", e)
+            # Minimal fallback: use whatever providers are registered (no-op if none)
             self.tracer = trace.get_tracer(__name__)
-            metrics.set_meter_provider(MeterProvider())
             self.meter = metrics.get_meter(__name__)
             self.tracing_enabled = False
         
@@ -295,214 +531,267 @@ class EnterpriseMonitoring:
             )
             logger.info("Custom OTel metrics configured")
         except Exception as e:
-            logger.warning(f"Failed to setup OTel metrics: {e}")
+            logger.warning("Failed to setup OTel metrics: %s", e)
     
     def instrument_fastapi(self, app):
         """Instrument FastAPI with OpenTelemetry"""
         try:
             if self.tracing_enabled:
-                FastAPIInstrumentor.instrument_app(app, tracer_provider=trace.get_tracer_provider())
-                RequestsInstrumentor().instrument()
+                FastAPIInstrumentor.instrument_app(
+                    app,
+                    tracer_provider=trace.get_tracer_provider(),
+                    excluded_urls=TRACING_EXCLUDED_URLS
+                )
                 logger.info(" FastAPI instrumented with OpenTelemetry")
             else:
                 logger.info("FastAPI instrumentation skipped (tracing disabled)")
         except Exception as e:
-            logger.warning(f"Failed to instrument FastAPI: {e}")
+            logger.warning("Failed to instrument FastAPI: %s", e)
         
         return app
     
+    @staticmethod
+    def _request_details(args, kwargs):
+        """Prompt and User-Agent of a (UserInput, Request) endpoint call; FastAPI passes them as kwargs"""
+        user_input = ""
+        user_agent = "unknown"
+        for value in (*args, *kwargs.values()):
+            if hasattr(value, 'prompt'):
+                user_input = value.prompt
+            elif hasattr(value, 'headers'):
+                user_agent = value.headers.get('user-agent', 'unknown')
+        return user_input, user_agent
+    
+    def _record_request_success(self, m: SimpleNamespace, user_agent: str, duration: float):
+        m.req_ok[classify_ua(user_agent)].inc()
+        m.req_duration.observe(duration)
+        
+        # Update OpenTelemetry metrics
+        try:
+            self.otel_request_counter.add(1, {
+                "method": "POST",
+                "status": "success",
+                "endpoint": "/api/mental-health"
+            })
+        except Exception:
+            pass
+    
+    def _record_request_error(self, m: SimpleNamespace, error_type: str, user_agent: str):
+        self._error_counter(error_type, 'api').inc()
+        m.req_err[classify_ua(user_agent)].inc()
+    
     def track_request(self, func):
         """Request tracking decorator with robust error handling"""
+        if MONITORING_DISABLED:
+            return func
+        if not self.tracing_enabled:
+            return self._track_request_untraced(func)
+        m = _metrics()
+        
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            start_time = time.time()
-            
-            # Create span only if tracing is enabled
-            if self.tracing_enabled:
-                span = self.tracer.start_span(
-                    f"{func.__name__}",
-                    attributes={
-                        "service.name": "mental-health-app",
-                        "service.version": "1.2.0",
-                        "operation.name": func.__name__
-                    }
-                )
-            else:
-                span = None
+            start = time.perf_counter()
+            span = self.tracer.start_span(
+                f"{func.__name__}",
+                attributes={
+                    "service.name": "mental-health-app",
+                    "service.version": "1.2.0",
+                    "operation.name": func.__name__
+                }
+            )
+            user_agent = "unknown"
             
             try:
                 # Extract request details
-                user_input = ""
-                user_agent = "unknown"
-                
-                if args and hasattr(args[0], 'prompt'):
-                    user_input = args[0].prompt
-                    if span:
-                        span.set_attribute("request.input_length", len(user_input))
-                
-                if len(args) > 1 and hasattr(args[1], 'headers'):
-                    user_agent = args[1].headers.get('user-agent', 'unknown')
-                    if span:
-                        span.set_attribute("http.user_agent", user_agent)
+                user_input, user_agent = self._request_details(args, kwargs)
+                span.set_attributes({
+                    "request.input_length": len(user_input),
+                    "http.user_agent": user_agent
+                })
                 
                 # Execute function
                 result = await func(*args, **kwargs)
                 
                 # Calculate metrics
-                duration = time.time() - start_time
+                duration = time.perf_counter() - start
                 response_length = len(result.get('response', '')) if isinstance(result, dict) else 0
+                self._record_request_success(m, user_agent, duration)
                 
-                # Update Prometheus metrics
-                REQUEST_COUNT.labels(
-                    method='POST',
-                    endpoint='/api/mental-health',
-                    status_code='200',
-                    user_agent=user_agent[:20]
-                ).inc()
-                
-                REQUEST_DURATION.labels(
-                    method='POST',
-                    endpoint='/api/mental-health'
-                ).observe(duration)
-                
-                # Update OpenTelemetry metrics
-                try:
-                    self.otel_request_counter.add(1, {
-                        "method": "POST",
-                        "status": "success",
-                        "endpoint": "/api/mental-health"
-                    })
-                except Exception:
-                    pass
+                # The handler's own quality score decides whether a low-quality reply keeps the trace
+                quality_score = getattr(result, 'quality_score', None)
+                low_quality = quality_score is not None and quality_score < LOW_QUALITY_SCORE
                 
                 # Update span attributes
-                if span:
-                    span.set_attribute("http.status_code", 200)
-                    span.set_attribute("response.length", response_length)
-                    span.set_attribute("request.duration", duration)
-
-                    span.set_status(trace.Status(trace.StatusCode.OK))
-                    span.end()
+                span.set_attributes({
+                    "http.status_code": 200,
+                    "response.length": response_length,
+                    "request.duration": duration,
+                    "sampling.priority": 1 if duration > SLOW_REQUEST_SECONDS or low_quality else 0
+                })
+                if quality_score is not None:
+                    span.set_attribute("response.quality", quality_score)
+                span.set_status(trace.Status(trace.StatusCode.OK))
+                span.end()
                 
-                logger.info(
-                    f" Request completed - duration: {duration:.2f}s, "
-                    f"input: {len(user_input)} chars, response: {response_length} chars"
-                )
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        " Request completed - duration: %.2fs, input: %d chars, response: %d chars, trace_id: %s",
+                        duration, len(user_input), response_length, hex(span.get_span_context().trace_id)
+                    )
                 
                 return result
                 
             except Exception as e:
-                duration = time.time() - start_time
                 error_type = type(e).__name__
-                
-                # Update error metrics
-                ERROR_RATE.labels(
-                    error_type=error_type,
-                    severity='high',
-                    component='api'
-                ).inc()
-                
-                REQUEST_COUNT.labels(
-                    method='POST',
-                    endpoint='/api/mental-health',
-                    status_code='500',
-                    user_agent=user_agent[:20]
-                ).inc()
+                self._record_request_error(m, error_type, user_agent)
                 
                 # Update span with error
-                if span:
-                    span.record_exception(e)
-                    span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-                    span.set_attribute("error.type", error_type)
-                    span.end()
+                span.record_exception(e)
+                span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+                span.set_attributes({"error.type": error_type, "sampling.priority": 1})
+                span.end()
                 
-                logger.error(f" Request failed: {e}")
+                logger.error(" Request failed: %s", e)
+                raise
+        
+        return wrapper
+    
+    def _track_request_untraced(self, func):
+        """track_request specialized for tracing disabled: metrics and logs only"""
+        m = _metrics()
+        
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            user_input, user_agent = self._request_details(args, kwargs)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                self._record_request_error(m, type(e).__name__, user_agent)
+                logger.error(" Request failed: %s", e)
                 raise
+            
+            duration = time.perf_counter() - start
+            self._record_request_success(m, user_agent, duration)
+            
+            if logger.isEnabledFor(logging.INFO):
+                response_length = len(result.get('response', '')) if isinstance(result, dict) else 0
+                logger.info(
+                    " Request completed - duration: %.2fs, input: %d chars, response: %d chars",
+                    duration, len(user_input), response_length
+                )
+            
+            return result
         
         return wrapper
     
     def track_ai_request(self, model_name: str):
         """Track AI model requests"""
-        def decorator(func):
+        m = _metrics()
+        ai_ok = m.ai_model_requests.labels(model_name=model_name, status='success')
+        ai_err = m.ai_model_requests.labels(model_name=model_name, status='error')
+        ai_latency = m.ai_model_latency.labels(model_name=model_name)
+        
+        def record_success(duration: float):
+            ai_ok.inc()
+            ai_latency.observe(duration)
+            try:
+                self.otel_ai_latency.record(duration, {
+                    "model_name": model_name,
+                    "status": "success"
+                })
+            except Exception:
+                pass
+        
+        def record_error(e: Exception):
+            ai_err.inc()
+            self._error_counter(type(e).__name__, 'ai_model').inc()
+            logger.error(" AI request failed: %s", e)
+        
+        def traced(func):
             @wraps(func)
             async def wrapper(*args, **kwargs):
-                start_time = time.time()
+                start = time.perf_counter()
+                span = self.tracer.start_span(
+                    f"ai_request_{model_name}",
+                    attributes={
+                        "ai.model.name": model_name,
+                        "ai.request.type": "text_generation"
+                    }
+                )
                 
-                span = None
-                if self.tracing_enabled:
-                    span = self.tracer.start_span(
-                        f"ai_request_{model_name}",
-                        attributes={
-                            "ai.model.name": model_name,
-                            "ai.request.type": "text_generation"
-                        }
-                    )
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    span.record_exception(e)
+                    span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+                    span.set_attribute("sampling.priority", 1)
+                    span.end()
+                    record_error(e)
+                    raise
+                
+                duration = time.perf_counter() - start
+                record_success(duration)
                 
+                span.set_attributes({
+                    "ai.response.length": len(str(result)),
+                    "ai.latency": duration,
+                    "sampling.priority": 1 if duration > SLOW_REQUEST_SECONDS else 0
+                })
+                span.set_status(trace.Status(trace.StatusCode.OK))
+                span.end()
+                
+                logger.info(" AI request completed - %s - %.2fs", model_name, duration)
+                return result
+            
+            return wrapper
+        
+        def untraced(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
                 try:
                     result = await func(*args, **kwargs)
-                    duration = time.time() - start_time
-                    
-                    # Update metrics
-                    AI_MODEL_REQUESTS.labels(
-                        model_name=model_name,
-                        status='success'
-                    ).inc()
-                    
-                    AI_MODEL_LATENCY.labels(
-                        model_name=model_name
-                    ).observe(duration)
-                    
-                    try:
-                        self.otel_ai_latency.record(duration, {
-                            "model_name": model_name,
-                            "status": "success"
-                        })
-                    except Exception:
-                        pass
-                    
-                    # Quality scoring
-                    quality_score = self._calculate_quality_score(result)
-                    RESPONSE_QUALITY_SCORE.labels(
-                        quality_dimension='overall'
-                    ).observe(quality_score)
-                    
-                    if span:
-                        span.set_attribute("ai.response.length", len(str(result)))
-                        span.set_attribute("ai.response.quality", quality_score)
-                        span.set_attribute("ai.latency", duration)
-
-                        span.set_status(trace.Status(trace.StatusCode.OK))
-                        span.end()
-                    
-                    logger.info(f" AI request completed - {model_name} - {duration:.2f}s")
-                    
-                    return result
-                    
                 except Exception as e:
-                    duration = time.time() - start_time
-                    
-                    AI_MODEL_REQUESTS.labels(
-                        model_name=model_name,
-                        status='error'
-                    ).inc()
-                    
-                    ERROR_RATE.labels(
-                        error_type=type(e).__name__,
-                        severity='high',
-                        component='ai_model'
-                    ).inc()
-                    
-                    if span:
-                        span.record_exception(e)
-                        span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-                        span.end()
-                    
-                    logger.error(f" AI request failed: {e}")
+                    record_error(e)
                     raise
+                
+                duration = time.perf_counter() - start
+                record_success(duration)
+                
+                logger.info(" AI request completed - %s - %.2fs", model_name, duration)
+                return result
             
             return wrapper
+        
+        def decorator(func):
+            if MONITORING_DISABLED:
+                return func
+            return traced(func) if self.tracing_enabled else untraced(func)
+        
         return decorator
     
+    def _error_counter(self, error_type: str, component: str):
+        """ERROR_RATE child for a high-severity error, bound on first use"""
+        key = (error_type, component)
+        counter = self._error_counters.get(key)
+        if counter is None:
+            counter = _metrics().error_rate.labels(error_type=error_type, severity='high', component=component)
+            self._error_counters[key] = counter
+        return counter
+    
+    def record_quality_score(self, quality_score: float):
+        """Record the quality score of a response served to the user"""
+        _metrics().quality_overall.observe(quality_score)
+    
+    def record_cache_hit(self, cache_tier: str):
+        """Count an AI response served from the given cache tier"""
+        _metrics().cache_hits.labels(cache_tier=cache_tier).inc()
+    
+    def defer(self, callback, *args):
+        """Run a synchronous tracking callback on a later event loop iteration"""
+        asyncio.get_running_loop().call_soon(callback, *args)
+    
     def track_conversation(self, session_id: str, message_count: int, satisfaction_score: Optional[float] = None):
         """Track conversation-level metrics"""
         if self.tracing_enabled:
@@ -517,7 +806,8 @@ class EnterpriseMonitoring:
                     span.set_attribute("conversation.satisfaction", satisfaction_score)
 
         
-        CONVERSATION_METRICS.labels(
+        m = _metrics()
+        m.conversation_metrics.labels(
             conversation_type='mental_health_support',
             completion_status='ongoing' if satisfaction_score is None else 'completed'
         ).inc()
@@ -531,53 +821,72 @@ class EnterpriseMonitoring:
             pass
         
         if satisfaction_score is not None:
-            USER_SATISFACTION.observe(satisfaction_score)
+            m.user_satisfaction.observe(satisfaction_score)
         
-        logger.info(f" Conversation tracked - {session_id} - {message_count} messages")
+        logger.info(" Conversation tracked - %s - %d messages", session_id, message_count)
     
     def update_session_count(self, session_id: str, action: str):
-        """Update active session count"""
+        """Update active session count; callers report each session's start and end exactly once"""
+        m = _metrics()
         if action == 'start':
-            self.active_sessions.add(session_id)
+            self._active_session_count += 1
+            m.active_sessions.inc()
+            m.sessions_started.inc()
         elif action == 'end':
-            self.active_sessions.discard(session_id)
-        
-        ACTIVE_SESSIONS.set(len(self.active_sessions))
+            self._active_session_count -= 1
+            m.active_sessions.dec()
+            m.sessions_ended.inc()
+    
+    @property
+    def active_sessions(self) -> int:
+        """Number of active sessions in this worker"""
+        return self._active_session_count
+    
+    def _collect_system_metrics_sync(self) -> Dict[str, float]:
+        """Take a psutil snapshot; CPU usage is measured since the previous call"""
+        memory = psutil.virtual_memory()
+        cpu_percent = psutil.cpu_percent(interval=None)
+        disk = psutil.disk_usage('/')
+        return {
+            'memory_percent': memory.percent,
+            'memory_available_gb': memory.available / (1024**3),
+            'cpu_percent': cpu_percent,
+            'disk_percent': (disk.used / disk.total) * 100,
+        }
+    
+    def _record_system_snapshot(self, snapshot: Dict[str, float]):
+        """Publish a system snapshot to Prometheus and memoize it for health checks"""
+        resource_gauges = _metrics().resource_gauges
+        for resource_type, value in snapshot.items():
+            resource_gauges[resource_type].set(value)
+        self._last_system_snapshot = snapshot
+    
+    @property
+    def last_system_snapshot(self) -> Dict[str, float]:
+        """Most recent system snapshot, collected without blocking if none exists yet"""
+        return self._last_system_snapshot or self.update_system_metrics()
     
-    def update_system_metrics(self):
+    def update_system_metrics(self) -> Dict[str, float]:
         """Update system resource metrics"""
-        try:
-            import psutil
-            
-            memory = psutil.virtual_memory()
-            SYSTEM_RESOURCES.labels(resource_type='memory_percent').set(memory.percent)
-            SYSTEM_RESOURCES.labels(resource_type='memory_available_gb').set(
-                memory.available / (1024**3)
-            )
-            
-            cpu_percent = psutil.cpu_percent(interval=1)
-            SYSTEM_RESOURCES.labels(resource_type='cpu_percent').set(cpu_percent)
-            
-            disk = psutil.disk_usage('/')
-            SYSTEM_RESOURCES.labels(resource_type='disk_percent').set(
-                (disk.used / disk.total) * 100
-            )
-            
-        except ImportError:
+        if not PSUTIL_AVAILABLE:
             logger.warning("psutil not available, skipping system metrics")
+            return {}
+        try:
+            snapshot = self._collect_system_metrics_sync()
+            self._record_system_snapshot(snapshot)
+            return snapshot
         except Exception as e:
-            logger.warning(f"Error updating system metrics: {e}")
+            logger.warning("Error updating system metrics: %s", e)
+            return {}
     
     def _calculate_quality_score(self, response: str) -> float:
         """Calculate response quality score"""
-        if len(response) < 10:
+        n = len(response)
+        if n < 10:
             return 0.2
-        elif len(response) > 500:
+        if n > 500:
             return 0.7
-        else:
-            empathy_words = ['understand', 'feel', 'support', 'help', 'care']
-            score = 0.5 + (sum(1 for word in empathy_words if word in response.lower()) * 0.1)
-            return min(score, 1.0)
+        return min(0.5 + 0.1 * len(_EMPATHY_RE.findall(response)), 1.0)
     
     async def start_background_tasks(self):
         """Start background monitoring tasks"""
@@ -586,12 +895,23 @@ class EnterpriseMonitoring:
     
     async def _system_metrics_updater(self):
         """Background task to update system metrics"""
+        if not PSUTIL_AVAILABLE:
+            logger.warning("psutil not available, skipping system metrics")
         while True:
             try:
-                self.update_system_metrics()
+                if PSUTIL_AVAILABLE:
+                    snapshot = await asyncio.to_thread(self._collect_system_metrics_sync)
+                    self._record_system_snapshot(snapshot)
+                m = _metrics()
+                if isinstance(self.span_processor, MonitoredBatchSpanProcessor):
+                    m.bsp_queue_depth.set(self.span_processor.queue_depth())
+                if self._otlp_http_session is not None:
+                    in_use, capacity = _http_pool_usage(self._otlp_http_session)
+                    m.otel_http_pool_inuse.set(in_use)
+                    m.otel_http_pool_max.set(capacity)
                 await asyncio.sleep(30)
             except Exception as e:
-                logger.error(f"Error updating system metrics: {e}")
+                logger.error("Error updating system metrics: %s", e)
                 await asyncio.sleep(60)
 
 # Global monitoring instance
@@ -0,0 +1,21 @@
+# gunicorn.conf.py - Prometheus multiprocess housekeeping for Gunicorn deployments
+# e.g. gunicorn app:app -c gunicorn.conf.py -w 4 -k uvicorn.workers.UvicornWorker
+import os
+import shutil
+
+# Must be set before prometheus_client is imported, here and in the forked workers
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prom_multiproc")
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):
+    """Start from an empty metrics directory, before any worker creates a metric"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop the exited worker's live gauge files"""
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,82 @@
+# semantic_cache.py - Embedding similarity cache for near-duplicate prompts
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+logger = logging.getLogger("semantic_cache")
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+SIMILARITY_THRESHOLD = 0.93
+
+# Opt-in: the embedding model costs every worker a few hundred MB of memory
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED") == "1"
+
+
+class SemanticCache:
+    """Second-tier response cache matching paraphrased inputs by cosine similarity"""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = 10_000, search_k: int = 4):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.search_k = search_k
+        self.model = None
+        self.index = None
+        self.responses: List[str] = []
+        self.context_keys: List[bytes] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.model is not None
+
+    def load(self):
+        """Load the embedding model and create an empty inner-product index"""
+        if not SEMANTIC_CACHE_ENABLED:
+            return
+        if not SEMANTIC_CACHE_AVAILABLE:
+            logger.warning("sentence-transformers/faiss not available, semantic cache disabled")
+            return
+        try:
+            self.model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+            self.index = faiss.IndexFlatIP(EMBEDDING_DIM)
+            logger.info("Semantic cache ready with %s", EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning("Failed to load semantic cache model: %s", e)
+            self.model = None
+
+    async def embed(self, text: str):
+        """Encode text off the event loop; vectors are L2-normalized so inner product is cosine"""
+        return await asyncio.to_thread(self.model.encode, text, normalize_embeddings=True)
+
+    def lookup(self, embedding, context_key: bytes) -> Optional[str]:
+        """Return a cached response for a similar input asked under the same context key"""
+        if not self.responses:
+            return None
+        scores, ids = self.index.search(embedding[None], min(self.search_k, len(self.responses)))
+        for score, idx in zip(scores[0], ids[0]):
+            if score < self.threshold:
+                break
+            if self.context_keys[idx] == context_key:
+                return self.responses[idx]
+        return None
+
+    def add(self, embedding, context_key: bytes, response: str):
+        """Store a response, starting over once the index is full"""
+        if len(self.responses) >= self.max_entries:
+            self.index.reset()
+            self.responses.clear()
+            self.context_keys.clear()
+        self.index.add(embedding[None])
+        self.responses.append(response)
+        self.context_keys.append(context_key)
+
+
+semantic_cache = SemanticCache()
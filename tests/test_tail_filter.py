@@ -0,0 +1,139 @@
+# tests/test_tail_filter.py - Tail sampling decisions of TailFilterSpanProcessor
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
+
+from enterprise_monitoring import TailFilterSpanProcessor
+
+
+@pytest.fixture
+def exporter():
+    return InMemorySpanExporter()
+
+
+@pytest.fixture
+def processor(exporter):
+    processor = TailFilterSpanProcessor(exporter, max_traces=2)
+    yield processor
+    processor.shutdown()
+
+
+@pytest.fixture
+def tracer(processor):
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    return provider.get_tracer(__name__)
+
+
+def exported(processor, exporter):
+    processor.force_flush()
+    return sorted(span.name for span in exporter.get_finished_spans())
+
+
+def start_trace(tracer, name="root"):
+    root = tracer.start_span(name)
+    return root, trace.set_span_in_context(root)
+
+
+def trace_id(span):
+    return span.get_span_context().trace_id
+
+
+def test_uninteresting_trace_is_dropped(tracer, processor, exporter):
+    root, ctx = start_trace(tracer)
+    tracer.start_span("child", context=ctx).end()
+    root.end()
+
+    assert exported(processor, exporter) == []
+    assert processor._decided[trace_id(root)] is False
+
+
+def test_child_spans_wait_for_the_root(tracer, processor, exporter):
+    root, ctx = start_trace(tracer)
+    child = tracer.start_span("child", context=ctx)
+    child.set_attribute("sampling.priority", 1)
+    child.end()
+
+    assert exported(processor, exporter) == []
+    assert trace_id(root) in processor._pending
+
+    root.end()
+    assert exported(processor, exporter) == ["child", "root"]
+    assert trace_id(root) not in processor._pending
+    assert processor._decided[trace_id(root)] is True
+
+
+def test_error_status_keeps_the_trace(tracer, processor, exporter):
+    root, ctx = start_trace(tracer)
+    tracer.start_span("child", context=ctx).end()
+    root.set_status(trace.Status(trace.StatusCode.ERROR))
+    root.end()
+
+    assert exported(processor, exporter) == ["child", "root"]
+
+
+def test_span_ending_after_kept_root_is_exported(tracer, processor, exporter):
+    root, ctx = start_trace(tracer)
+    late = tracer.start_span("late", context=ctx)
+    root.set_attribute("sampling.priority", 1)
+    root.end()
+    late.end()
+
+    assert exported(processor, exporter) == ["late", "root"]
+
+
+def test_span_ending_after_dropped_root_is_dropped(tracer, processor, exporter):
+    root, ctx = start_trace(tracer)
+    late = tracer.start_span("late", context=ctx)
+    late_error = tracer.start_span("late_error", context=ctx)
+    root.end()
+    late.end()
+    late_error.set_status(trace.Status(trace.StatusCode.ERROR))
+    late_error.end()
+
+    # An interesting span still goes out on its own once the trace was dropped
+    assert exported(processor, exporter) == ["late_error"]
+
+
+def test_span_with_remote_parent_is_a_local_root(tracer, processor, exporter):
+    remote = SpanContext(
+        trace_id=0x1234, span_id=0x5678, is_remote=True, trace_flags=TraceFlags(TraceFlags.SAMPLED)
+    )
+    span = tracer.start_span("server", context=trace.set_span_in_context(NonRecordingSpan(remote)))
+    span.set_attribute("sampling.priority", 1)
+    span.end()
+
+    assert exported(processor, exporter) == ["server"]
+    assert processor._pending == {}
+    assert processor._decided[0x1234] is True
+
+
+def test_oldest_pending_trace_is_evicted(tracer, processor, exporter):
+    roots = []
+    for name in ("first", "second", "third"):
+        root, ctx = start_trace(tracer, name)
+        child = tracer.start_span(f"{name}_child", context=ctx)
+        child.set_attribute("sampling.priority", 1)
+        child.end()
+        roots.append(root)
+
+    assert list(processor._pending) == [trace_id(root) for root in roots[1:]]
+
+    for root in roots:
+        root.end()
+
+    # The first trace lost its buffered child, and with it the reason to keep the root
+    assert exported(processor, exporter) == ["second", "second_child", "third", "third_child"]
+
+
+def test_oldest_decision_is_evicted(tracer, processor, exporter):
+    roots = []
+    for name in ("first", "second", "third"):
+        root, _ = start_trace(tracer, name)
+        root.set_attribute("sampling.priority", 1)
+        root.end()
+        roots.append(root)
+
+    assert list(processor._decided) == [trace_id(root) for root in roots[1:]]
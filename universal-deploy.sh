@@ -10,6 +10,9 @@ YELLOW='\033[1;33m'
 BLUE='\033[0;34m'
 NC='\033[0m'
 
+# GCP service account key, configured once; override with GCP_SA_KEY_FILE
+GCP_SA_KEY_FILE="${GCP_SA_KEY_FILE:-/users/shrinidhirajagopal/Downloads/GCP_SA_Key.json}"
+
 print_status() {
     echo -e "${BLUE}[INFO]${NC} $1"
 }
@@ -53,7 +56,7 @@ check_prerequisites() {
     fi
     
     # Check if we have the GCP key
-    if [ ! -f "/users/shrinidhirajagopal/Downloads/GCP_SA_Key.json" ]; then
+    if [ ! -f "$GCP_SA_KEY_FILE" ]; then
         print_warning "GCP key file not found. Some features may not work."
     fi
     
@@ -90,10 +93,10 @@ deploy_kubernetes() {
     build_images
     
     # Create GCP secret
-    if [ -f "/users/shrinidhirajagopal/Downloads/GCP_SA_Key.json" ]; then
+    if [ -f "$GCP_SA_KEY_FILE" ]; then
         kubectl delete secret genai-secret 2>/dev/null || true
         kubectl create secret generic genai-secret \
-            --from-file=api_key=/users/shrinidhirajagopal/Downloads/GCP_SA_Key.json
+            --from-file=api_key="$GCP_SA_KEY_FILE"
         print_success "GCP secret created"
     fi
     
@@ -168,7 +171,7 @@ deploy_docker() {
 deploy_local() {
     print_status "Setting up local development..."
     export GOOGLE_CLOUD_PROJECT=spheric-hawk-447520-e5
-    export GOOGLE_APPLICATION_CREDENTIALS="/users/shrinidhirajagopal/Downloads/GCP_SA_Key.json"
+    export GOOGLE_APPLICATION_CREDENTIALS="$GCP_SA_KEY_FILE"
     
     print_status "Installing Python dependencies..."
     pip install -r requirements.txt
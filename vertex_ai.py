@@ -1,7 +1,12 @@
 from pydantic_ai import Agent, ModelRetry
 from pydantic_ai.models.vertexai import VertexAIModel
 from pydantic import BaseModel
+import asyncio
+import httpx
 import os
+from typing import Dict, Optional
+
+from agent import ConversationManager
 
 # --- Google Cloud Configuration ---
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
@@ -9,6 +14,10 @@ SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
 LOCATION = "us-central1"
 MODEL = "gemini-2.5-flash-preview-05-20"
 
+# Shared HTTP/2 connection pool for Vertex AI
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+
 # Validate environment variables
 if not PROJECT_ID or not SERVICE_ACCOUNT_FILE:
     raise ValueError("Environment variables GOOGLE_CLOUD_PROJECT and GOOGLE_APPLICATION_CREDENTIALS must be set.")
@@ -17,12 +26,6 @@ class MentalHealthResponse(BaseModel):
     text: str
 
 class MentalHealthAgent(Agent):
-    model = VertexAIModel(
-        model_name=MODEL,
-        service_account_file=SERVICE_ACCOUNT_FILE,
-        project_id=PROJECT_ID,
-        region=LOCATION,
-    )
     result_type = MentalHealthResponse
 
     system_prompt = """
@@ -62,12 +65,132 @@ class MentalHealthAgent(Agent):
             raise ModelRetry("The response is empty.")
         return response
 
+_http_client: Optional[httpx.AsyncClient] = None
+_AGENT: Optional[MentalHealthAgent] = None
+
+def open_http_client() -> httpx.AsyncClient:
+    """
+    Create the pooled client shared by all Vertex AI calls, and the agent that uses it.
+    Built once per app lifespan so credentials, auth tokens and connections are reused
+    across prompts; a closed client is replaced rather than reused.
+    """
+    global _http_client, _AGENT
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            http2=True,
+        )
+        model = VertexAIModel(
+            model_name=MODEL,
+            service_account_file=SERVICE_ACCOUNT_FILE,
+            project_id=PROJECT_ID,
+            region=LOCATION,
+            http_client=_http_client,
+        )
+        _AGENT = MentalHealthAgent(model=model)
+    return _http_client
+
+async def close_http_client():
+    if _http_client is not None:
+        await _http_client.aclose()
+
+def http_pool_stats() -> dict:
+    """Connection counts for the shared client's pool"""
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    return {
+        "open": _http_client is not None and not _http_client.is_closed,
+        "connections": len(connections),
+        "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    }
+
 async def get_mental_health_response(prompt: str) -> str:
-    agent = MentalHealthAgent(model=VertexAIModel(
-        model_name=MODEL,
-        service_account_file=SERVICE_ACCOUNT_FILE,
-        project_id=PROJECT_ID,
-        region=LOCATION,
-    ))
-    response = await agent.run(prompt)
-    return response.data
+    if _http_client is None or _http_client.is_closed:
+        raise RuntimeError("Vertex AI client is not open")
+    return (await _AGENT.run(prompt)).data
+
+class DedupVertexClient:
+    """
+    Shares one Vertex AI call between identical prompts that are in flight at the same
+    time. Gemini's online API takes one prompt per call, so there is nothing to batch
+    and every other prompt goes straight through.
+    """
+
+    def __init__(self, get_response_fn):
+        self._get_response_fn = get_response_fn
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._closed = False
+
+    def open(self):
+        """Accept requests again after close(), for the next app lifespan"""
+        self._closed = False
+
+    async def close(self):
+        """Fail callers still waiting on another caller's request and reject new ones"""
+        self._closed = True
+        for future in self._inflight.values():
+            self._settle(future, exception=RuntimeError("Vertex AI client closed"))
+        self._inflight.clear()
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result=None, exception: Optional[Exception] = None):
+        if future.done():
+            return
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+            future.exception()  # Mark retrieved; it is only an error for callers waiting on it
+
+    async def submit(self, prompt: str) -> str:
+        if self._closed:
+            raise RuntimeError("Vertex AI client closed")
+        future = self._inflight.get(prompt)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[prompt] = future
+        try:
+            result = await self._get_response_fn(prompt)
+        except Exception as e:
+            self._settle(future, exception=e)
+            raise
+        except BaseException:
+            self._settle(future, exception=RuntimeError("Vertex AI request was cancelled"))
+            raise
+        else:
+            self._settle(future, result)
+            return result
+        finally:
+            if self._inflight.get(prompt) is future:
+                del self._inflight[prompt]
+
+async def mental_health_chat():
+    """
+    Terminal chat with the companion. input() runs on a worker thread, so one event
+    loop, agent and HTTP pool serve the whole conversation.
+    """
+    loop = asyncio.get_running_loop()
+    manager = ConversationManager()
+    open_http_client()
+    try:
+        while True:
+            try:
+                user_input = await loop.run_in_executor(None, input, "How are you feeling? ")
+            except EOFError:
+                break
+            if user_input.strip().lower() == 'exit':
+                break
+            response = await manager.process_input(user_input, get_mental_health_response)
+            print(f"Companion: {response}\n")
+    finally:
+        await close_http_client()
+
+if __name__ == "__main__":
+    asyncio.run(mental_health_chat())